@@ -1,9 +1,14 @@
+import io
 import os
 import sys
 import time
 import subprocess
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import openpyxl
 import pandas as pd
 import streamlit as st
 
@@ -30,28 +35,43 @@ st.set_page_config(page_title="Laptop CMS Pipeline Dashboard", layout="wide")
 # =========================
 # Playwright Chromium install (Cloud)
 # =========================
+@st.cache_resource(show_spinner=False)
 def ensure_playwright_browser():
     """
     Streamlit Cloud does NOT install Chromium automatically.
-    This installs it once and marks completion.
+    This installs it once (per server process, in a background thread so the
+    page keeps rendering) and marks completion.
+    Returns the install Future, or None if Chromium is already installed.
     """
     marker = BASE_DIR / ".pw_installed"
     if marker.exists():
-        return
+        return None
+
+    def install():
+        subprocess.run(
+            [sys.executable, "-m", "playwright", "install", "chromium"],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        marker.write_text("ok")
+
+    return ThreadPoolExecutor(max_workers=1).submit(install)
+
+def wait_for_playwright_browser() -> bool:
+    future = ensure_playwright_browser()
+    if future is None:
+        return True
 
     with st.spinner("Installing Playwright Chromium (first run only)…"):
         try:
-            subprocess.run(
-                [sys.executable, "-m", "playwright", "install", "chromium"],
-                check=True,
-                capture_output=True,
-                text=True,
-            )
-            marker.write_text("ok")
+            future.result()
+            return True
         except Exception as e:
+            ensure_playwright_browser.clear()  # retry on next rerun
             st.error("Playwright browser install failed.")
             st.code(str(e))
-            st.stop()
+            return False
 
 ensure_playwright_browser()
 
@@ -65,25 +85,113 @@ def latest_output_csv():
 def tail_text(path: Path, max_chars=20000):
     if not path.exists():
         return ""
-    return path.read_text(encoding="utf-8", errors="ignore")[-max_chars:]
+    # read only the end of the file (x4 covers multi-byte UTF-8), the log grows across runs
+    with path.open("rb") as f:
+        f.seek(max(0, path.stat().st_size - max_chars * 4))
+        data = f.read()
+    return data.decode("utf-8", errors="ignore")[-max_chars:]
+
+def input_key():
+    s = INPUT_XLSX.stat()
+    return (s.st_mtime_ns, s.st_size)
+
+def fast_read_input(columns=("sku",)) -> pd.DataFrame:
+    """
+    Read only `columns` from the first sheet of input.xlsx.
+    openpyxl read-only mode streams the sheet instead of building every cell
+    like pd.read_excel does. Trailing blank rows are dropped, as pandas does.
+    """
+    wb = openpyxl.load_workbook(INPUT_XLSX, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        ws.reset_dimensions()  # don't trust the sheet's <dimension> tag (as pd.read_excel)
+        rows = ws.iter_rows(values_only=True)
+        header = list(next(rows, ()))
+        idx = {c: header.index(c) for c in columns if c in header}
+        data = {c: [] for c in idx}
+        n_rows = 0
+        for n, row in enumerate(rows, start=1):
+            for c, i in idx.items():
+                data[c].append(row[i] if i < len(row) else None)
+            if any(v is not None for v in row):
+                n_rows = n
+    finally:
+        wb.close()
+    return pd.DataFrame({c: v[:n_rows] for c, v in data.items()}, index=range(n_rows))
+
+@st.cache_data(show_spinner=False)
+def read_input_df(key: tuple) -> pd.DataFrame:
+    # `key` is input_key(); it only exists so a new upload invalidates the cache
+    return fast_read_input()
+
+def names_with_suffix(folder: Path, suffix: str) -> set[str]:
+    # one directory listing instead of one stat() per SKU
+    with os.scandir(folder) as it:
+        return {e.name[:-len(suffix)] for e in it if e.name.endswith(suffix)}
 
 def sku_status_table(df: pd.DataFrame):
-    rows = []
-    for _, r in df.iterrows():
-        sku = str(r.get("sku", "")).strip()
-        rows.append({
-            "sku": sku,
-            "html": (HTML_DIR / f"{sku}.html").exists(),
-            "screenshot": (LOG_DIR / f"{sku}.png").exists(),
-            "groq_cache": (CACHE_DIR / f"{sku}.json").exists(),
-        })
-    return pd.DataFrame(rows)
+    # normalize the whole column at once (blank cells -> "", missing column -> all "")
+    skus = df.get("sku", pd.Series("", index=df.index)).astype("string").str.strip().fillna("")
+    return pd.DataFrame({
+        "sku": skus,
+        # .html.gz since the HTML cache is compressed; plain .html from older runs
+        "html": skus.isin(names_with_suffix(HTML_DIR, ".html.gz") | names_with_suffix(HTML_DIR, ".html")),
+        "screenshot": skus.isin(names_with_suffix(LOG_DIR, ".png")),
+        "groq_cache": skus.isin(names_with_suffix(CACHE_DIR, ".json")),
+    })
+
+@st.cache_data(show_spinner=False, ttl=30)
+def _sku_status_table(key: tuple) -> pd.DataFrame:
+    return sku_status_table(read_input_df(key[:2]))
+
+def sku_status_table_cached() -> pd.DataFrame:
+    """
+    Streamlit reruns the whole script on every interaction.
+    Recompute only when input.xlsx or one of the output dirs changed
+    (dir mtime moves whenever a file is created or deleted).
+    """
+    key = input_key() + tuple(d.stat().st_mtime_ns for d in (HTML_DIR, LOG_DIR, CACHE_DIR))
+    return _sku_status_table(key)
 
 # =========================
 # Run pipeline IN-PROCESS (shows full traceback)
 # =========================
+class LiveOutput(io.TextIOBase):
+    """
+    stdout/stderr sink for the in-process run.
+    Output is pushed to the placeholder as the pipeline prints it
+    (throttled to one redraw per `min_interval`), instead of only
+    showing up once the whole run has finished.
+    Only the last `max_writes` writes are kept, so a long run does not
+    grow (and re-copy) one ever-larger string on every redraw.
+    The pipeline also logs from its scrape thread; only the script thread
+    (the one that created this sink) may touch Streamlit elements.
+    """
+    def __init__(self, placeholder, max_chars=20000, min_interval=0.2, max_writes=800):
+        self.placeholder = placeholder
+        self.max_chars = max_chars
+        self.min_interval = min_interval
+        self.tail = deque(maxlen=max_writes)
+        self.last_render = 0.0
+        self.owner = threading.current_thread()
+
+    def writable(self):
+        return True
+
+    def write(self, s):
+        self.tail.append(s)
+        if threading.current_thread() is self.owner and time.monotonic() - self.last_render >= self.min_interval:
+            self.render()
+        return len(s)
+
+    def getvalue(self):
+        return "".join(self.tail)
+
+    def render(self):
+        self.placeholder.code(self.getvalue()[-self.max_chars:], language="text")
+        self.last_render = time.monotonic()
+
 def run_pipeline_inprocess():
-    import io
     import runpy
     import traceback
     from contextlib import redirect_stdout, redirect_stderr
@@ -98,14 +206,14 @@ def run_pipeline_inprocess():
 
     st.info("Running pipeline inside Streamlit (this captures full errors)…")
 
-    buf = io.StringIO()
+    buf = LiveOutput(st.empty())
 
     try:
         with redirect_stdout(buf), redirect_stderr(buf):
             runpy.run_path(str(PIPELINE_SCRIPT), run_name="__main__")
 
+        buf.render()
         st.success("Pipeline finished successfully ✅")
-        st.code(buf.getvalue()[-20000:])
 
     except Exception:
         st.error("Pipeline failed ❌ (full traceback below)")
@@ -129,14 +237,14 @@ if upload:
     st.success("input.xlsx uploaded")
 
 if INPUT_XLSX.exists():
-    df = pd.read_excel(INPUT_XLSX)
+    df = read_input_df(input_key())
     st.write(f"Rows in input.xlsx: {len(df)}")
 else:
     st.warning("input.xlsx not found")
 
 st.divider()
 
-if st.button("▶ Run pipeline"):
+if st.button("▶ Run pipeline") and wait_for_playwright_browser():
     run_pipeline_inprocess()
 
 st.divider()
@@ -152,7 +260,7 @@ st.divider()
 
 st.subheader("SKU status")
 if INPUT_XLSX.exists():
-    st.dataframe(sku_status_table(pd.read_excel(INPUT_XLSX)), use_container_width=True)
+    st.dataframe(sku_status_table_cached(), use_container_width=True)
 
 st.divider()
 
@@ -19,19 +19,27 @@ def _write_startup_crash(_e: Exception):
 # --- END STARTUP CRASH LOGGER ---
 
 try:
+    import asyncio
+    import atexit
     import csv
-    import json
+    import gzip
+    import hashlib
+    import operator
     import os
     import random
     import re
+    import threading
     import time
+    from concurrent.futures import ThreadPoolExecutor
     from datetime import datetime
     from urllib.parse import urlparse
 
+    import lxml.html
+    import orjson
     import pandas as pd
     import requests
-    from bs4 import BeautifulSoup
-    from playwright.sync_api import sync_playwright, TimeoutError as PWTimeout
+    from lxml import etree
+    from playwright.async_api import async_playwright, TimeoutError as PWTimeout
 
 except Exception as e:
     _write_startup_crash(e)
@@ -42,18 +50,25 @@ except Exception as e:
 # =========================
 BASE_DIR = Path(__file__).parent.resolve()
 INPUT_XLSX = BASE_DIR / "input.xlsx"
+INPUT_COLUMNS = ["sku", "ean", "shipping_weight", "color", "product_type", "url", "mm43", "category"]
 
 HTML_DIR = BASE_DIR / "clean_html"
 LOG_DIR = BASE_DIR / "logs"
 CACHE_DIR = BASE_DIR / "groq_cache"
+PAYLOAD_CACHE_DIR = CACHE_DIR / "payload"
 
 HTML_DIR.mkdir(exist_ok=True)
 LOG_DIR.mkdir(exist_ok=True)
 CACHE_DIR.mkdir(exist_ok=True)
+PAYLOAD_CACHE_DIR.mkdir(exist_ok=True)
 
 TIMESTAMP = datetime.now().strftime("%Y%m%d_%H%M%S")
 OUT_CSV = BASE_DIR / f"laptop_cms_template_{TIMESTAMP}.csv"
 PIPELINE_LOG = LOG_DIR / "one_run_pipeline.log"
+# Chromium profile (cookies, localStorage, HTTP cache) kept across runs, so consent
+# banners stay dismissed and static assets revalidate instead of downloading again
+BROWSER_PROFILE_DIR = BASE_DIR / "browser_profile"
+COOKIE_HINTS_FILE = BASE_DIR / "cookie_hints.json"
 
 NA = "#NA"
 
@@ -65,11 +80,22 @@ MAX_SCRAPE_ATTEMPTS = 3
 NAV_TIMEOUT_MS = 90000
 WAIT_AFTER_GOTO_MS = 2000
 
-SKIP_HTML_IF_EXISTS_OVER_BYTES = 50_000
+SKIP_HTML_IF_EXISTS_OVER_BYTES = 50_000  # uncompressed size
+# clean_html/{sku}.html.gz: pages shrink ~5-8x; level 3 keeps the writer thread cheap
+HTML_GZIP_LEVEL = 3
+# gap between fetches to the same host, times that host's backoff factor
+# (x2 after a failed/blocked fetch, -DOMAIN_BACKOFF_STEP after a good one)
 DELAY_RANGE = (3.0, 6.0)
+MAX_DOMAIN_BACKOFF = 8.0
+DOMAIN_BACKOFF_STEP = 0.25
 
 RESUME_FROM_OLD_CSV = True
 
+# concurrent browser contexts (one page each) sharing one Chromium
+SCRAPE_WORKERS = 4
+# rows scraped ahead of the row currently waiting on Groq
+SCRAPE_AHEAD = SCRAPE_WORKERS * 2
+
 # =========================
 # EXACT CSV HEADERS
 # =========================
@@ -93,22 +119,54 @@ HEADERS = [
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GROQ_URL = "https://api.groq.com/openai/v1/chat/completions"
 MODEL = "openai/gpt-oss-120b"
+GROQ_TEMPERATURE = 0.2
+GROQ_SYSTEM_PROMPT = "You must output strict JSON only. No explanations."
+
+# one keep-alive connection pool for all Groq calls (no TLS handshake per SKU)
+_SESSION = requests.Session()
+_SESSION.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=4))
+if GROQ_API_KEY:
+    _SESSION.headers.update({"Authorization": f"Bearer {GROQ_API_KEY}"})
 
 # =========================
 # GROQ RATE LIMIT / RETRY
 # =========================
-MIN_DELAY_BETWEEN_CALLS = 3.0
+# client-side limits, enforced before each request (set to your Groq plan's limits);
+# 20 RPM matches the old fixed 3s gap between calls
+GROQ_RPM = 20
+GROQ_TPM = 250_000
+# products per Groq request; a batch is sent early when the next product would push
+# its prompt past GROQ_BATCH_MAX_TOKENS. A request over the plan's per-minute token
+# limit is rejected with 413, and the reply counts toward it too, hence half of TPM.
+GROQ_BATCH_SIZE = 5
+GROQ_BATCH_MAX_TOKENS = min(GROQ_TPM // 2, 16_000)
+# one product's payload is sized before batching: if it estimates over
+# GROQ_PAYLOAD_MAX_TOKENS, visible_text is cut (not below MIN_VISIBLE_CHARS)
+GROQ_PAYLOAD_MAX_TOKENS = min(6_000, GROQ_BATCH_MAX_TOKENS)
+MAX_VISIBLE_CHARS = 18_000
+MIN_VISIBLE_CHARS = 4_000
 MAX_GROQ_RETRIES = 6
 BACKOFF_BASE = 2.0
 BACKOFF_JITTER = (0.2, 0.8)
-_last_call_ts = 0.0
 
 # =========================
 # LOGGING
 # =========================
+# one buffered handle for the whole run (shared by the scrape thread), flushed every LOG_FLUSH_EVERY lines
+LOG_FLUSH_EVERY = 32
+_LOG_FH = PIPELINE_LOG.open("a", encoding="utf-8", buffering=65536)
+_LOG_LOCK = threading.Lock()
+_log_lines = 0
+atexit.register(_LOG_FH.close)
+
 def log(line: str):
+    global _log_lines
     print(line)
-    PIPELINE_LOG.open("a", encoding="utf-8").write(line + "\n")
+    with _LOG_LOCK:
+        _LOG_FH.write(line + "\n")
+        _log_lines += 1
+        if _log_lines % LOG_FLUSH_EVERY == 0:
+            _LOG_FH.flush()
 
 # =========================
 # UTILS
@@ -119,25 +177,63 @@ def host(url: str) -> str:
 def is_amazon(url: str) -> bool:
     return "amazon." in host(url)
 
+_WS_RE = re.compile(r"\s+")
+_JSON_RE = re.compile(r"\{.*\}", re.DOTALL)
+_JSON_ARRAY_RE = re.compile(r"\[.*\]", re.DOTALL)
+
 def collapse_ws(s: str) -> str:
-    return re.sub(r"\s+", " ", s or "").strip()
-
-def pace_calls():
-    global _last_call_ts
-    now = time.time()
-    wait = MIN_DELAY_BETWEEN_CALLS - (now - _last_call_ts)
-    if wait > 0:
-        time.sleep(wait)
-    _last_call_ts = time.time()
-
-def normalize_to_headers(row: dict) -> dict:
-    out = {}
-    for h in HEADERS:
-        v = row.get(h, NA)
-        if v is None or (isinstance(v, str) and v.strip() == ""):
-            v = NA
-        out[h] = v
-    return out
+    return _WS_RE.sub(" ", s or "").strip()
+
+def estimate_tokens(text: str) -> int:
+    # ~4 chars per token; close enough for pacing
+    return len(text) // 4 + 1
+
+class RateLimiter:
+    """
+    Token buckets for requests/min and tokens/min.
+    acquire() blocks until the request fits, so we stay under the server limit
+    instead of finding it with 429s.
+    """
+    def __init__(self, rpm: int, tpm: int):
+        self.capacity = (float(rpm), float(tpm))
+        self.rate = (rpm / 60.0, tpm / 60.0)
+        self.level = list(self.capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        self.level = [min(cap, lvl + rate * elapsed) for cap, lvl, rate in zip(self.capacity, self.level, self.rate)]
+
+    def acquire(self, tokens: int):
+        need = (1.0, min(float(tokens), self.capacity[1]))
+        while True:
+            self._refill()
+            wait = max(
+                self.blocked_until - time.monotonic(),
+                *((n - lvl) / rate for n, lvl, rate in zip(need, self.level, self.rate)),
+            )
+            if wait <= 0:
+                break
+            time.sleep(wait)
+        self.level = [lvl - n for lvl, n in zip(self.level, need)]
+
+    def pause(self, seconds: float):
+        # server said 429: empty the buckets and hold every caller for `seconds`
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.level = [0.0, 0.0]
+
+GROQ_LIMITER = RateLimiter(GROQ_RPM, GROQ_TPM)
+
+def normalize_to_headers(row: dict, _headers=tuple(HEADERS), _na=NA) -> dict:
+    # missing / None / blank -> NA; defaults bind the constants as fast locals
+    get = row.get
+    return {
+        h: _na if (v := get(h)) is None or (isinstance(v, str) and not v.strip()) else v
+        for h in _headers
+    }
 
 def latest_output_csv() -> Path | None:
     candidates = sorted(BASE_DIR.glob("laptop_cms_template_*.csv"), key=lambda p: p.stat().st_mtime, reverse=True)
@@ -157,91 +253,210 @@ def load_done_skus_from_csv(csv_path: Path) -> set[str]:
         pass
     return done
 
+# =========================
+# HTML PARSING (lxml)
+# =========================
+NOISE_TAGS = ("script", "style", "noscript", "svg", "canvas", "iframe")
+BOILERPLATE_TAGS = ("nav", "footer")  # dropped from the Groq payload only
+_HTML_PARSER = lxml.html.HTMLParser(encoding="utf-8")
+
+def parse_html(html: bytes):
+    """lxml tree of the page with NOISE_TAGS emptied (their tail text is kept)."""
+    root = etree.fromstring(html, _HTML_PARSER)
+    if root is None:  # empty document
+        return etree.Element("html")
+    for el in list(root.iter(*NOISE_TAGS)):
+        el.clear(keep_tail=True)
+    return root
+
+def visible_text(el) -> str:
+    # same output as BeautifulSoup's get_text(" ", strip=True)
+    return " ".join(t for t in (s.strip() for s in el.itertext()) if t)
+
 # =========================
 # CAPTCHA/BLOCK DETECTION
 # =========================
-def looks_blocked_visible_text(html: str) -> bool:
-    soup = BeautifulSoup(html, "lxml")
-    for t in soup(["script", "style", "noscript", "svg", "canvas", "iframe"]):
-        t.decompose()
-    text = soup.get_text(" ", strip=True).lower()
-
-    strong = [
-        "enter the characters you see",
-        "verify you are a human",
-        "robot check",
-        "not a robot",
-        "unusual traffic",
-        "automated access",
-    ]
-    if any(s in text for s in strong):
+BLOCK_PHRASES = (
+    "enter the characters you see",
+    "verify you are a human",
+    "robot check",
+    "not a robot",
+    "unusual traffic",
+    "automated access",
+)
+CAPTCHA_HINTS = ("verify", "robot", "human", "unusual traffic")
+
+def looks_blocked_visible_text(root) -> bool:
+    text = visible_text(root).lower()
+
+    # a few `in` scans (C fastsearch) beat one regex alternation on page-sized text
+    if any(s in text for s in BLOCK_PHRASES):
         return True
-    if "captcha" in text and any(s in text for s in ["verify", "robot", "human", "unusual traffic"]):
+    if "captcha" in text and any(s in text for s in CAPTCHA_HINTS):
         return True
     return False
 
+# first-2KB digests of pages flagged by looks_blocked_visible_text() this run, so the
+# scraper can spot the same challenge page again and retry without returning it
+_BLOCK_SIGNATURES = set()
+
+def _block_signature(html: bytes) -> bytes | None:
+    # real product pages are over SKIP_HTML_IF_EXISTS_OVER_BYTES and are never matched
+    if len(html) >= SKIP_HTML_IF_EXISTS_OVER_BYTES:
+        return None
+    return hashlib.blake2b(html[:2048], digest_size=16).digest()
+
+def remember_block_page(html: bytes):
+    sig = _block_signature(html)
+    if sig:
+        _BLOCK_SIGNATURES.add(sig)
+
+def is_known_block_page(html: bytes) -> bool:
+    sig = _block_signature(html)
+    return sig is not None and sig in _BLOCK_SIGNATURES
+
 # =========================
 # PLAYWRIGHT HELPERS
 # =========================
-def try_accept_cookies(page) -> bool:
-    selectors = [
-        "#sp-cc-accept",
-        "button:has-text('Accept')",
-        "button:has-text('Accept All')",
-        "button:has-text('I Accept')",
-        "button:has-text('Agree')",
-        "button:has-text('Allow all')",
-    ]
-    for sel in selectors:
+COOKIE_SELECTORS = (
+    "#sp-cc-accept",
+    "button:has-text('Accept')",
+    "button:has-text('Accept All')",
+    "button:has-text('I Accept')",
+    "button:has-text('Agree')",
+    "button:has-text('Allow all')",
+)
+
+def load_cookie_hints() -> dict:
+    try:
+        hints = orjson.loads(COOKIE_HINTS_FILE.read_bytes())
+    except Exception:
+        return {}
+    return {h: sel for h, sel in hints.items() if sel}  # older files also kept misses
+
+# host -> selector that accepted the banner last time ("" = no banner found).
+# Only hits go to cookie_hints.json: a miss may just be a captcha page or a slow
+# banner, so it holds for this run only. Delete the file to re-probe every host.
+_COOKIE_HINTS = load_cookie_hints()
+
+async def try_accept_cookies(page) -> bool:
+    h = host(page.url)
+    if h in _COOKIE_HINTS:
+        # seen this host before: only its known selector, short timeout, no full probe
+        sel = _COOKIE_HINTS[h]
+        if not sel:
+            return False
         try:
-            page.locator(sel).first.click(timeout=2000)
-            page.wait_for_timeout(800)
+            await page.locator(sel).first.click(timeout=500)
+            await page.wait_for_timeout(800)
             return True
+        except Exception:
+            return False  # usually: consent already stored in the browser profile
+
+    found = ""
+    for sel in COOKIE_SELECTORS:
+        try:
+            await page.locator(sel).first.click(timeout=2000)
+            await page.wait_for_timeout(800)
+            found = sel
+            break
         except Exception:
             pass
-    return False
+    _COOKIE_HINTS[h] = found
+    try:
+        if found:
+            hits = {h: sel for h, sel in _COOKIE_HINTS.items() if sel}
+            COOKIE_HINTS_FILE.write_bytes(orjson.dumps(hits, option=orjson.OPT_INDENT_2))
+    except Exception:
+        pass
+    return bool(found)
 
-def wait_for_important_content(page, url: str):
+async def wait_for_important_content(page, url: str):
     try:
         if is_amazon(url):
-            page.wait_for_selector("#productTitle, #title, #centerCol", timeout=12000)
+            await page.wait_for_selector("#productTitle, #title, #centerCol", timeout=12000)
         else:
-            page.wait_for_selector("h1", timeout=12000)
+            await page.wait_for_selector("h1", timeout=12000)
     except Exception:
         pass
 
+# Images and tracker hosts are switched off at the browser level, not with
+# context.route(): routing disables Chromium's HTTP cache, which the persistent
+# profile keeps warm for scripts, stylesheets and fonts across runs.
+BLOCKED_HOSTS = (
+    "doubleclick.net",
+    "googletagmanager.com",
+    "google-analytics.com",
+    "googlesyndication.com",
+    "segment.io",
+    "facebook.net",
+)
+BROWSER_ARGS = [
+    "--blink-settings=imagesEnabled=false",
+    "--host-resolver-rules=" + ", ".join(
+        f"MAP {pattern} ~NOTFOUND" for h in BLOCKED_HOSTS for pattern in (h, f"*.{h}")
+    ),
+]
+
+CONTEXT_OPTIONS = {
+    "locale": "en-US",
+    "timezone_id": "Asia/Kolkata",
+    "viewport": {"width": 1366, "height": 768},
+    "extra_http_headers": {"Accept-Language": "en-US,en;q=0.9"},
+}
+# for the fresh-context retry after a known block page
+RETRY_USER_AGENTS = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36",
+)
+
 # =========================
 # HTML -> COMPACT PAYLOAD (AVOIDS 413)
 # =========================
-def html_to_compact_payload(html: str, max_visible_chars: int = 18000) -> dict:
-    soup = BeautifulSoup(html, "lxml")
-    for t in soup(["script", "style", "noscript", "svg", "canvas", "iframe"]):
-        t.decompose()
+# bump when _compact_payload's output changes, so cached payloads are rebuilt
+PAYLOAD_FORMAT = 2  # 2: nav/footer dropped
+
+def html_to_compact_payload(html: bytes, root, max_visible_chars: int = 18000) -> dict:
+    # Same HTML -> same payload: resume runs re-read cached HTML, so skip the extraction.
+    # `root` is parse_html(html), already built for the block check.
+    digest = hashlib.blake2b(html, digest_size=16).hexdigest()
+    p = PAYLOAD_CACHE_DIR / f"{digest}_{max_visible_chars}_v{PAYLOAD_FORMAT}.json"
+    if p.exists():
+        try:
+            return orjson.loads(p.read_bytes())
+        except Exception:
+            pass
+
+    payload = _compact_payload(root, max_visible_chars)
+    write_cache_file(p, orjson.dumps(payload))
+    return payload
+
+def _compact_payload(root, max_visible_chars: int) -> dict:
+    # site menus / footers: link lists that eat the visible_text budget (the tail 25%
+    # was mostly footer); the block check has already run on the full tree
+    for el in list(root.iter(*BOILERPLATE_TAGS)):
+        el.clear(keep_tail=True)
 
-    title = collapse_ws(soup.title.get_text()) if soup.title else ""
+    title_el = root.find(".//title")
+    title = collapse_ws("".join(title_el.itertext())) if title_el is not None else ""
     meta_desc = ""
-    md = soup.select_one("meta[name='description']")
-    if md and md.get("content"):
+    md = root.find(".//meta[@name='description']")
+    if md is not None and md.get("content"):
         meta_desc = collapse_ws(md.get("content"))
 
     table_lines = []
-    for tr in soup.select("tr"):
-        cells = [collapse_ws(c.get_text(" ", strip=True)) for c in tr.find_all(["th", "td"])]
+    for tr in root.iter("tr"):
+        cells = [collapse_ws(visible_text(c)) for c in tr.iter("th", "td")]
         if len(cells) >= 2:
             k, v = cells[0], cells[1]
             if k and v and len(k) <= 70 and len(v) <= 220:
                 table_lines.append(f"{k}: {v}")
 
-    seen = set()
-    tables = []
-    for line in table_lines:
-        if line not in seen:
-            tables.append(line)
-            seen.add(line)
-    tables_text = "\n".join(tables[:140]) if tables else NA
+    tables = list(dict.fromkeys(table_lines))[:140]  # dedupe, keep order
+    tables_text = "\n".join(tables) if tables else NA
 
-    body = soup.body or soup
-    text = collapse_ws(body.get_text(" ", strip=True))
+    body = root.find(".//body")
+    text = collapse_ws(visible_text(body if body is not None else root))
     if len(text) > max_visible_chars:
         head = text[: int(max_visible_chars * 0.75)]
         tail = text[-int(max_visible_chars * 0.25):]
@@ -254,15 +469,19 @@ def html_to_compact_payload(html: str, max_visible_chars: int = 18000) -> dict:
         "visible_text": text or NA,
     }
 
+def sized_payload(html: bytes, root) -> dict:
+    # rebuild with less visible text now rather than send an oversized prompt to Groq
+    payload = html_to_compact_payload(html, root, MAX_VISIBLE_CHARS)
+    over = estimate_tokens("".join(payload.values())) - GROQ_PAYLOAD_MAX_TOKENS
+    visible = len(payload["visible_text"])
+    if over > 0 and visible > MIN_VISIBLE_CHARS:
+        payload = html_to_compact_payload(html, root, max(MIN_VISIBLE_CHARS, visible - over * 4))
+    return payload
+
 # =========================
 # GROQ PROMPT + CALL
 # =========================
-def build_prompt(input_row: dict, payload: dict) -> str:
-    return f"""
-Return ONLY a valid JSON object (no markdown, no extra text).
-The JSON MUST contain EXACTLY these keys (all of them):
-{HEADERS}
-
+PROMPT_RULES = f"""
 Rules:
 - If unknown, use "{NA}".
 - Keep values factual and short. No promotional language.
@@ -279,74 +498,180 @@ Mapping rules from input.xlsx (must follow):
 - product_type -> attributes__lulu_product_type
 - mm43 -> attributes__version (if not empty else "{NA}")
 - category -> attributes__other_information (if not empty else "{NA}")
+""".strip()
+
+def build_prompt(input_row: dict, payload: dict) -> str:
+    return f"""
+Return ONLY a valid JSON object (no markdown, no extra text).
+The JSON MUST contain EXACTLY these keys (all of them):
+{HEADERS}
+
+{PROMPT_RULES}
 
 Input.xlsx row:
-{json.dumps(input_row, ensure_ascii=False)}
+{orjson.dumps(input_row).decode()}
 
 Webpage content (trimmed):
-{json.dumps(payload, ensure_ascii=False)}
+{orjson.dumps(payload).decode()}
 
 Output the JSON object only.
 """.strip()
 
-def call_groq_with_retries(prompt: str) -> dict:
+def build_batch_prompt(items: list[tuple[dict, dict]]) -> str:
+    sections = "\n\n".join(
+        f"""### Product {n}
+Input.xlsx row:
+{orjson.dumps(input_row).decode()}
+
+Webpage content (trimmed):
+{orjson.dumps(payload).decode()}"""
+        for n, (input_row, payload) in enumerate(items, start=1)
+    )
+    return f"""
+Return ONLY a valid JSON array of exactly {len(items)} objects (no markdown, no extra text),
+one object per product below, in the same order.
+Each object MUST contain EXACTLY these keys (all of them):
+{HEADERS}
+
+{PROMPT_RULES}
+
+{sections}
+
+Output the JSON array only.
+""".strip()
+
+def call_groq_with_retries(prompt: str, pattern: re.Pattern = _JSON_RE) -> dict | list:
     if not GROQ_API_KEY:
         raise RuntimeError("Missing GROQ_API_KEY env var (Streamlit Secrets / local environment).")
 
-    headers = {
-        "Authorization": f"Bearer {GROQ_API_KEY}",
-        "Content-Type": "application/json",
-    }
     body = {
         "model": MODEL,
-        "temperature": 0.2,
+        "temperature": GROQ_TEMPERATURE,
         "messages": [
-            {"role": "system", "content": "You must output strict JSON only. No explanations."},
+            {"role": "system", "content": GROQ_SYSTEM_PROMPT},
             {"role": "user", "content": prompt},
         ],
     }
 
+    tokens = estimate_tokens(prompt)
     for attempt in range(1, MAX_GROQ_RETRIES + 1):
-        pace_calls()
-        r = requests.post(GROQ_URL, headers=headers, json=body, timeout=180)
+        GROQ_LIMITER.acquire(tokens)
+        r = _SESSION.post(GROQ_URL, json=body, timeout=180)
 
         if r.status_code == 429:
-            backoff = (BACKOFF_BASE ** (attempt - 1)) + random.uniform(*BACKOFF_JITTER)
+            try:
+                backoff = float(r.headers.get("retry-after"))
+            except (TypeError, ValueError):
+                backoff = (BACKOFF_BASE ** (attempt - 1)) + random.uniform(*BACKOFF_JITTER)
             log(f"429 rate_limited attempt={attempt}/{MAX_GROQ_RETRIES} sleeping={backoff:.2f}s")
-            time.sleep(backoff)
+            GROQ_LIMITER.pause(backoff)
             continue
 
         r.raise_for_status()
 
-        data = r.json()
+        data = orjson.loads(r.content)
         text = data["choices"][0]["message"]["content"].strip()
-        m = re.search(r"\{.*\}", text, flags=re.DOTALL)
+        m = pattern.search(text)
         if not m:
             raise ValueError(f"No JSON found. First 200 chars:\n{text[:200]}")
-        return json.loads(m.group(0))
+        return orjson.loads(m.group(0))
 
     raise RuntimeError("Max retries exceeded (rate limit / transient errors).")
 
+def call_groq_batch(items: list[tuple[dict, dict]]) -> list[dict | None]:
+    """
+    One Groq request for up to GROQ_BATCH_SIZE products.
+    Returns one model row per item (None if the model left it out).
+    """
+    if len(items) == 1:
+        return [call_groq_with_retries(build_prompt(*items[0]))]
+
+    rows = call_groq_with_retries(build_batch_prompt(items), _JSON_ARRAY_RE)
+    rows = [r for r in rows if isinstance(r, dict)]
+    reply_skus = [str(r.get("sku", "")).strip() for r in rows]
+    wanted = [input_row["sku"] for input_row, _ in items]
+    if reply_skus == wanted:
+        return rows
+
+    # A reply object goes to at most one product: match on a SKU that appears once
+    # in the reply; fall back to position only for objects carrying no product's SKU.
+    # Anything else is None, so flush_batch retries that product on its own.
+    out = [None] * len(items)
+    used = set()
+    for n, sku in enumerate(wanted):
+        if reply_skus.count(sku) == 1 and wanted.count(sku) == 1:
+            i = reply_skus.index(sku)
+            out[n] = rows[i]
+            used.add(i)
+    if len(rows) == len(items):
+        for n in range(len(items)):
+            if out[n] is None and n not in used and reply_skus[n] not in wanted:
+                out[n] = rows[n]
+    return out
+
+# =========================
+# PER-DOMAIN PACING
+# =========================
+# only touched from the scraper's event loop thread
+_domain_backoff = {}  # host -> backoff factor >= 1
+_domain_next_fetch = {}  # host -> loop time the next fetch may start
+
+async def pace_domain(url: str):
+    # reserve this host's next slot, then wait for it; other hosts don't wait
+    h = host(url)
+    loop = asyncio.get_running_loop()
+    now = loop.time()
+    start = max(now, _domain_next_fetch.get(h, 0.0))
+    _domain_next_fetch[h] = start + random.uniform(*DELAY_RANGE) * _domain_backoff.get(h, 1.0)
+    if start > now:
+        await asyncio.sleep(start - now)
+
+def record_domain_result(url: str, ok: bool):
+    h = host(url)
+    backoff = _domain_backoff.get(h, 1.0)
+    if ok:
+        _domain_backoff[h] = max(1.0, backoff - DOMAIN_BACKOFF_STEP)
+    else:
+        _domain_backoff[h] = min(MAX_DOMAIN_BACKOFF, backoff * 2)
+        log(f"PACING host={h} backoff={_domain_backoff[h]:.2f}")
+
 # =========================
 # CACHE HELPERS
 # =========================
-def read_cached_html_if_ok(sku: str) -> str | None:
-    html_path = HTML_DIR / f"{sku}.html"
-    if html_path.exists():
+# HTML / payload / Groq cache files are written on one background thread so the
+# main loop and the scrape loop don't wait on disk; main() drains it before exiting.
+_CACHE_WRITER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-writer")
+
+def write_cache_file(path: Path, data: bytes, compress: bool = False):
+    def write():
         try:
-            if html_path.stat().st_size >= SKIP_HTML_IF_EXISTS_OVER_BYTES:
-                return html_path.read_text(encoding="utf-8", errors="ignore")
-        except Exception:
+            path.write_bytes(gzip.compress(data, HTML_GZIP_LEVEL, mtime=0) if compress else data)
+        except Exception as e:
+            log(f"WARN cache write failed {path.name}: {e}")
+    _CACHE_WRITER.submit(write)
+
+def html_cache_path(sku: str) -> Path:
+    return HTML_DIR / f"{sku}.html.gz"
+
+def read_cached_html_if_ok(sku: str) -> bytes | None:
+    try:
+        html = gzip.decompress(html_cache_path(sku).read_bytes())
+    except FileNotFoundError:
+        try:
+            html = (HTML_DIR / f"{sku}.html").read_bytes()  # cached before compression
+        except OSError:
             return None
-    return None
+    except Exception:
+        return None
+    return html if len(html) >= SKIP_HTML_IF_EXISTS_OVER_BYTES else None
 
-def scrape_html(page, sku: str, url: str) -> tuple[bool, str]:
+async def scrape_html(page, sku: str, url: str) -> tuple[bool, bytes]:
     cached = read_cached_html_if_ok(sku)
     if cached:
         log(f"HTML_CACHE_HIT {sku} bytes={len(cached)}")
         return True, cached
 
-    out_file = HTML_DIR / f"{sku}.html"
+    out_file = html_cache_path(sku)
     shot_file = LOG_DIR / f"{sku}.png"
 
     log(f"FETCH {sku} {url}")
@@ -355,26 +680,35 @@ def scrape_html(page, sku: str, url: str) -> tuple[bool, str]:
     for attempt in range(1, MAX_SCRAPE_ATTEMPTS + 1):
         try:
             log(f"  attempt={attempt}/{MAX_SCRAPE_ATTEMPTS}")
-            page.goto(url, wait_until="domcontentloaded", timeout=NAV_TIMEOUT_MS)
-            page.wait_for_timeout(WAIT_AFTER_GOTO_MS)
+            await pace_domain(url)
+            await page.goto(url, wait_until="domcontentloaded", timeout=NAV_TIMEOUT_MS)
+            await page.wait_for_timeout(WAIT_AFTER_GOTO_MS)
 
-            if try_accept_cookies(page):
+            if await try_accept_cookies(page):
                 log("  cookies=accepted")
 
             if attempt < 3:
-                wait_for_important_content(page, url)
+                await wait_for_important_content(page, url)
             else:
-                page.wait_for_timeout(1000)
-
-            html = page.content()
-
-            try:
-                page.screenshot(path=str(shot_file), full_page=True)
-            except Exception:
-                pass
+                await page.wait_for_timeout(1000)
+
+            html = (await page.content()).encode("utf-8")  # bytes from here on: written, hashed and parsed as-is
+            if is_known_block_page(html):
+                # the same page/profile/UA would most likely get it again: one clean try
+                log("  WARN known block page -> retry in a fresh context")
+                html = await fetch_in_fresh_context(url, shot_file)
+                if not html or is_known_block_page(html):
+                    last_err = "known block page"
+                    break
+            else:
+                try:
+                    await page.screenshot(path=str(shot_file), full_page=True)
+                except Exception:
+                    pass
 
-            out_file.write_text(html, encoding="utf-8")
-            log(f"SAVED {sku} bytes={out_file.stat().st_size} final_url={page.url} screenshot={shot_file.name}")
+            write_cache_file(out_file, html, compress=True)
+            log(f"SAVED {sku} bytes={len(html)} final_url={page.url} screenshot={shot_file.name}")
+            record_domain_result(url, True)
             return True, html
 
         except PWTimeout as e:
@@ -385,46 +719,169 @@ def scrape_html(page, sku: str, url: str) -> tuple[bool, str]:
             log(f"  WARN error: {e}")
 
     try:
-        html_fail = page.content()
-        out_file.write_text(html_fail, encoding="utf-8")
+        html_fail = (await page.content()).encode("utf-8")
+        write_cache_file(out_file, html_fail, compress=True)
     except Exception:
-        html_fail = ""
+        html_fail = b""
     log(f"SCRAPE_FAIL {sku} | {last_err}")
+    record_domain_result(url, False)
     return False, html_fail
 
-def cache_path_for_sku(sku: str) -> Path:
-    return CACHE_DIR / f"{sku}.json"
-
-def read_cached_groq_json(sku: str) -> dict | None:
-    p = cache_path_for_sku(sku)
-    if p.exists():
+# =========================
+# SCRAPE THREAD
+# =========================
+# One Chromium with SCRAPE_WORKERS contexts, driven by an asyncio loop on a
+# background thread. The main thread submits rows with _submit_scrape() and
+# gets a concurrent.futures.Future back, so Groq calls and CSV writes stay
+# synchronous on the main thread.
+_scraper = {}
+
+async def _open_browser():
+    _scraper["pw"] = await async_playwright().start()
+    # one persistent context with a page per worker; the pages still load concurrently
+    context = await _scraper["pw"].chromium.launch_persistent_context(
+        str(BROWSER_PROFILE_DIR), headless=HEADLESS, slow_mo=SLOW_MO, args=BROWSER_ARGS, **CONTEXT_OPTIONS
+    )
+    _scraper["context"] = context
+    _scraper["pages"] = asyncio.Queue()
+    for i in range(SCRAPE_WORKERS):
+        # the profile opens with a blank tab; use it as the first worker page
+        page = context.pages[i] if i < len(context.pages) else await context.new_page()
+        _scraper["pages"].put_nowait(page)
+
+async def fetch_in_fresh_context(url: str, shot_file: Path) -> bytes | None:
+    # Block-page retry: a throwaway context in a second, non-persistent Chromium
+    # (no profile cookies) with another user agent. That browser starts on first use.
+    if "retry_browser" not in _scraper:
+        _scraper["retry_browser"] = asyncio.ensure_future(
+            _scraper["pw"].chromium.launch(headless=HEADLESS, args=BROWSER_ARGS)
+        )
+    context = None
+    try:
+        browser = await _scraper["retry_browser"]
+        context = await browser.new_context(user_agent=random.choice(RETRY_USER_AGENTS), **CONTEXT_OPTIONS)
+        page = await context.new_page()
+        await pace_domain(url)
+        await page.goto(url, wait_until="domcontentloaded", timeout=NAV_TIMEOUT_MS)
+        await page.wait_for_timeout(WAIT_AFTER_GOTO_MS)
+        await try_accept_cookies(page)
+        await wait_for_important_content(page, url)
+        html = (await page.content()).encode("utf-8")
         try:
-            return json.loads(p.read_text(encoding="utf-8"))
+            await page.screenshot(path=str(shot_file), full_page=True)
         except Exception:
-            return None
-    return None
+            pass
+        return html
+    except Exception as e:
+        log(f"  WARN fresh-context retry failed: {e}")
+        return None
+    finally:
+        if context is not None:
+            await context.close()
+
+async def _close_browser():
+    if "retry_browser" in _scraper:
+        try:
+            await (await _scraper["retry_browser"]).close()
+        except Exception:
+            pass
+    if "context" in _scraper:
+        await _scraper["context"].close()  # also closes the browser, flushing the profile
+    if "pw" in _scraper:
+        await _scraper["pw"].stop()
 
-def write_cached_groq_json(sku: str, data: dict):
-    p = cache_path_for_sku(sku)
-    p.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+async def _scrape_task(sku: str, url: str) -> tuple[bool, bytes]:
+    page = await _scraper["pages"].get()
+    try:
+        return await scrape_html(page, sku, url)
+    finally:
+        _scraper["pages"].put_nowait(page)
+
+def _start_scraper():
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, name="scraper", daemon=True)
+    thread.start()
+    _scraper.update(loop=loop, thread=thread)
+    try:
+        asyncio.run_coroutine_threadsafe(_open_browser(), loop).result()
+    except Exception:
+        _stop_scraper()
+        raise
+
+def _stop_scraper():
+    loop = _scraper["loop"]
+    try:
+        asyncio.run_coroutine_threadsafe(_close_browser(), loop).result()
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        _scraper["thread"].join()
+        loop.close()
+        _scraper.clear()
+
+def _submit_scrape(sku: str, url: str):
+    return asyncio.run_coroutine_threadsafe(_scrape_task(sku, url), _scraper["loop"])
+
+def cache_path_for_sku(sku: str) -> Path:
+    return CACHE_DIR / f"{sku}.json"
+
+def cached_groq_skus() -> set[str]:
+    # one directory listing up front instead of a stat() per row
+    with os.scandir(CACHE_DIR) as it:
+        return {e.name[:-5] for e in it if e.name.endswith(".json") and e.is_file()}
+
+def groq_cache_key(input_row: dict) -> str:
+    # everything a cached row depends on except the page itself, so editing the model,
+    # request settings, prompt templates (rendered empty) or input row re-queries that SKU
+    return hashlib.blake2b(
+        orjson.dumps([
+            MODEL,
+            GROQ_TEMPERATURE,
+            GROQ_SYSTEM_PROMPT,
+            build_prompt({}, {}),
+            build_batch_prompt([({}, {})]),
+            input_row,
+        ]),
+        digest_size=8,
+    ).hexdigest()
+
+def read_cached_groq_json(sku: str, key: str) -> dict | None:
+    try:
+        data = orjson.loads(cache_path_for_sku(sku).read_bytes())
+    except Exception:
+        return None
+    # files written before keys existed carry none and are still trusted
+    if data.pop("_cache_key", key) != key:
+        log(f"GROQ_CACHE_STALE sku={sku} (prompt/model/input changed)")
+        return None
+    return data
+
+def write_cached_groq_json(sku: str, data: dict, key: str):
+    write_cache_file(
+        cache_path_for_sku(sku), orjson.dumps({**data, "_cache_key": key}, option=orjson.OPT_INDENT_2)
+    )
 
 # =========================
 # NA ROW
 # =========================
-def make_na_row(input_row: dict) -> dict:
-    row = {h: NA for h in HEADERS}
-    sku = input_row.get("sku", NA)
+NA_TEMPLATE = dict.fromkeys(HEADERS, NA)
+
+def _apply_input_mappings(row: dict, input_row: dict) -> dict:
+    # input sheet values win over the model, except a model-filled other_information
+    sku = input_row["sku"]
     row["sku"] = sku
     row["base_code"] = sku
-
-    row["attributes__lulu_ean"] = (input_row.get("ean") or "").strip() or NA
-    row["attributes__shipping_weight"] = (input_row.get("shipping_weight") or "").strip() or NA
-    row["attributes__color"] = (input_row.get("color") or "").strip() or NA
-    row["attributes__lulu_product_type"] = (input_row.get("product_type") or "").strip() or NA
-    row["attributes__version"] = (input_row.get("mm43") or "").strip() or NA
-    row["attributes__other_information"] = (input_row.get("category") or "").strip() or NA
+    row["attributes__lulu_ean"] = input_row["ean"] or NA
+    row["attributes__shipping_weight"] = input_row["shipping_weight"] or NA
+    row["attributes__color"] = input_row["color"] or NA
+    row["attributes__lulu_product_type"] = input_row["product_type"] or NA
+    row["attributes__version"] = input_row["mm43"] or NA
+    if row["attributes__other_information"] == NA:
+        row["attributes__other_information"] = input_row["category"] or NA
     return row
 
+def make_na_row(input_row: dict) -> dict:
+    return _apply_input_mappings(NA_TEMPLATE.copy(), input_row)
+
 # =========================
 # MAIN
 # =========================
@@ -433,7 +890,8 @@ def main():
     if not INPUT_XLSX.exists():
         raise FileNotFoundError(f"input.xlsx not found at: {INPUT_XLSX}")
 
-    df = pd.read_excel(INPUT_XLSX)
+    # only the columns the pipeline uses, as text (no int -> float when a column has blanks)
+    df = pd.read_excel(INPUT_XLSX, dtype=str, usecols=lambda c: c in INPUT_COLUMNS)
 
     done_skus = set()
     if RESUME_FROM_OLD_CSV:
@@ -444,103 +902,159 @@ def main():
         else:
             log("RESUME_FROM_OLD_CSV no previous output found")
 
-    with OUT_CSV.open("w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=HEADERS)
-        writer.writeheader()
-
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=HEADLESS, slow_mo=SLOW_MO)
-            context = browser.new_context(
-                locale="en-US",
-                timezone_id="Asia/Kolkata",
-                viewport={"width": 1366, "height": 768},
-                extra_http_headers={"Accept-Language": "en-US,en;q=0.9"},
-            )
-            page = context.new_page()
-
-            for _, r in df.iterrows():
-                input_row = {
-                    "sku": str(r.get("sku", "")).strip(),
-                    "ean": str(r.get("ean", "")).strip(),
-                    "shipping_weight": str(r.get("shipping_weight", "")).strip(),
-                    "color": str(r.get("color", "")).strip(),
-                    "product_type": str(r.get("product_type", "")).strip(),
-                    "url": str(r.get("url", "")).strip(),
-                    "mm43": str(r.get("mm43", "")).strip(),
-                    "category": str(r.get("category", "")).strip(),
-                }
+    groq_cached = cached_groq_skus()
+
+    # normalize whole columns once (missing column / blank cell -> "")
+    df = df.reindex(columns=INPUT_COLUMNS, fill_value="").fillna("")
+    for c in INPUT_COLUMNS:
+        df[c] = df[c].str.strip()
+    input_rows = df.to_dict(orient="records")
+
+    def needs_scrape(input_row: dict) -> bool:
+        sku = input_row["sku"]
+        if not sku or not input_row["url"]:
+            return False
+        if RESUME_FROM_OLD_CSV and sku in done_skus:
+            return False
+        return sku not in groq_cached
+
+    # Scrapes for the next SCRAPE_AHEAD rows run while the current row waits on Groq.
+    _start_scraper()
+    pending = {}  # row index -> Future[(ok_scrape, html)]
+    prefetched = set()
+    ahead = 0
+
+    try:
+        with OUT_CSV.open("w", newline="", encoding="utf-8", buffering=1 << 20) as f:
+            writer = csv.writer(f)
+            writer.writerow(HEADERS)
+            row_values = operator.itemgetter(*HEADERS)  # dict -> tuple in HEADERS order, in C
+
+            def write_row(row: dict):
+                # buffered; f.flush() runs before every wait on a scrape or Groq call,
+                # so the CSV stays readable mid-run without a write() per cache-hit row
+                writer.writerow(row_values(row))
+
+            # Scraped rows wait here for one shared Groq request, so they are written
+            # when their batch returns (after any cache-hit / NA rows that came later).
+            batch = []  # (input_row, payload)
+            # rows Groq returned this run, so a SKU repeated in the sheet is served from
+            # memory (its cache file may still be queued on the background writer)
+            fresh_rows = {}  # sku -> (cache key, model row)
+
+            def flush_batch():
+                items = batch[:]
+                batch.clear()
+                if not items:
+                    return
+                f.flush()
+                try:
+                    model_rows = call_groq_batch(items)
+                    err = "missing from batch response"
+                except Exception as e:
+                    model_rows = [None] * len(items)
+                    err = e
+                    if len(items) > 1:
+                        log(f"GROQ_BATCH_FAIL size={len(items)} err={e} -> retrying one by one")
+
+                for (input_row, payload), model_row in zip(items, model_rows):
+                    sku = input_row["sku"]
+                    # NA rows count as done on resume, so a bad batch reply gets a
+                    # single-product retry before any of its products is given up on
+                    if not model_row and len(items) > 1:
+                        try:
+                            model_row = call_groq_with_retries(build_prompt(input_row, payload))
+                        except Exception as e:
+                            err = e
+                    if not model_row:
+                        log(f"ROW_FAIL groq sku={sku} err={err} -> NA row")
+                        write_row(make_na_row(input_row))
+                        continue
+
+                    key = groq_cache_key(input_row)
+                    write_cached_groq_json(sku, model_row, key)
+                    fresh_rows[sku] = (key, model_row)
+
+                    final_row = _apply_input_mappings(normalize_to_headers(model_row), input_row)
+
+                    write_row(final_row)
+                    log(f"ROW_OK sku={sku} -> wrote row + cached groq_cache/{sku}.json")
+
+            for i, input_row in enumerate(input_rows):
+                ahead = max(ahead, i)
+                while ahead < len(input_rows) and len(pending) < SCRAPE_AHEAD:
+                    nxt = input_rows[ahead]
+                    if needs_scrape(nxt) and nxt["sku"] not in prefetched:
+                        prefetched.add(nxt["sku"])  # repeats are served from fresh_rows
+                        pending[ahead] = _submit_scrape(nxt["sku"], nxt["url"])
+                    ahead += 1
 
                 sku = input_row["sku"]
                 url = input_row["url"]
 
                 if not sku or not url:
                     log(f"ROW_SKIP missing sku/url sku={sku} url={url}")
-                    writer.writerow(make_na_row(input_row))
+                    write_row(make_na_row(input_row))
                     continue
 
                 if RESUME_FROM_OLD_CSV and sku in done_skus:
                     log(f"ROW_SKIP already_in_old_csv sku={sku}")
                     continue
 
-                cached_groq = read_cached_groq_json(sku)
+                if any(queued["sku"] == sku for queued, _ in batch):
+                    flush_batch()  # repeat of a queued SKU: get that row first
+                key = groq_cache_key(input_row)
+                fresh = fresh_rows.get(sku)
+                if fresh and fresh[0] == key:
+                    cached_groq = fresh[1]
+                else:
+                    cached_groq = read_cached_groq_json(sku, key) if sku in groq_cached else None
                 if cached_groq:
-                    final_row = normalize_to_headers(cached_groq)
-                    final_row["sku"] = sku
-                    final_row["base_code"] = sku
-                    final_row["attributes__lulu_ean"] = input_row["ean"] or NA
-                    final_row["attributes__shipping_weight"] = input_row["shipping_weight"] or NA
-                    final_row["attributes__color"] = input_row["color"] or NA
-                    final_row["attributes__lulu_product_type"] = input_row["product_type"] or NA
-                    final_row["attributes__version"] = input_row["mm43"] or NA
-                    if final_row["attributes__other_information"] == NA:
-                        final_row["attributes__other_information"] = input_row["category"] or NA
-
-                    writer.writerow(final_row)
+                    pending.pop(i, None)
+                    final_row = _apply_input_mappings(normalize_to_headers(cached_groq), input_row)
+
+                    write_row(final_row)
                     log(f"GROQ_CACHE_HIT sku={sku} -> wrote row")
                     continue
 
-                ok_scrape, html = scrape_html(page, sku, url)
+                # unreadable or stale cache file: not prefetched, scrape it now
+                future = pending.pop(i, None) or _submit_scrape(sku, url)
+                if not future.done():
+                    f.flush()
+                ok_scrape, html = future.result()
                 if not ok_scrape or not html:
                     log(f"ROW_FAIL scrape sku={sku} -> NA row")
-                    writer.writerow(make_na_row(input_row))
-                    time.sleep(random.uniform(*DELAY_RANGE))
+                    write_row(make_na_row(input_row))
                     continue
 
-                if looks_blocked_visible_text(html):
+                root = parse_html(html)  # parsed once, shared by the block check and payload
+                if looks_blocked_visible_text(root):
                     log(f"ROW_SKIP blocked_visible_text sku={sku} -> NA row")
-                    writer.writerow(make_na_row(input_row))
-                    time.sleep(random.uniform(*DELAY_RANGE))
+                    remember_block_page(html)
+                    _scraper["loop"].call_soon_threadsafe(record_domain_result, url, False)
+                    write_row(make_na_row(input_row))
                     continue
 
                 try:
-                    payload = html_to_compact_payload(html, max_visible_chars=18000)
-                    prompt = build_prompt(input_row, payload)
-                    model_row = call_groq_with_retries(prompt)
-
-                    write_cached_groq_json(sku, model_row)
-
-                    final_row = normalize_to_headers(model_row)
-                    final_row["sku"] = sku
-                    final_row["base_code"] = sku
-                    final_row["attributes__lulu_ean"] = input_row["ean"] or NA
-                    final_row["attributes__shipping_weight"] = input_row["shipping_weight"] or NA
-                    final_row["attributes__color"] = input_row["color"] or NA
-                    final_row["attributes__lulu_product_type"] = input_row["product_type"] or NA
-                    final_row["attributes__version"] = input_row["mm43"] or NA
-                    if final_row["attributes__other_information"] == NA:
-                        final_row["attributes__other_information"] = input_row["category"] or NA
-
-                    writer.writerow(final_row)
-                    log(f"ROW_OK sku={sku} -> wrote row + cached groq_cache/{sku}.json")
-
+                    payload = sized_payload(html, root)
                 except Exception as e:
-                    log(f"ROW_FAIL groq sku={sku} err={e} -> NA row")
-                    writer.writerow(make_na_row(input_row))
+                    log(f"ROW_FAIL payload sku={sku} err={e} -> NA row")
+                    write_row(make_na_row(input_row))
+                    continue
 
-                time.sleep(random.uniform(*DELAY_RANGE))
+                item = (input_row, payload)
+                if batch and estimate_tokens(build_batch_prompt(batch + [item])) > GROQ_BATCH_MAX_TOKENS:
+                    flush_batch()
+                batch.append(item)
+                if len(batch) >= GROQ_BATCH_SIZE:
+                    flush_batch()
 
-            context.close()
-            browser.close()
+            flush_batch()
+    finally:
+        for future in pending.values():
+            future.cancel()
+        _stop_scraper()
+        _CACHE_WRITER.shutdown(wait=True)
 
     log("=== PIPELINE END ===")
     print(f"DONE: {OUT_CSV}")
@@ -555,3 +1069,5 @@ if __name__ == "__main__":
         # write full traceback for Streamlit Cloud debugging
         _write_startup_crash(e)
         raise
+    finally:
+        _LOG_FH.close()